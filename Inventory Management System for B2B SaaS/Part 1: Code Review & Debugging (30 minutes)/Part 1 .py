@@ -27,84 +27,114 @@ Multiple Commits	Can leave data half-written if inventory fails.
 """
 
 from flask import request, jsonify
+from sqlalchemy import select, text
 from sqlalchemy.exc import IntegrityError
-from decimal import Decimal, InvalidOperation
+from decimal import Decimal
+from typing import Annotated
+import msgspec
+
+# Include other optional product fields here as needed
+CREATE_PRODUCT_WITH_INVENTORY = text("""
+    WITH new_product AS (
+        INSERT INTO products (name, sku, price)
+        VALUES (:name, :sku, :price)
+        ON CONFLICT (sku) DO NOTHING
+        RETURNING id
+    )
+    INSERT INTO inventory (product_id, warehouse_id, quantity)
+    SELECT new_product.id, w.warehouse_id, w.quantity
+    FROM new_product,
+         unnest(CAST(:warehouse_ids AS integer[]), CAST(:quantities AS integer[])) AS w(warehouse_id, quantity)
+    RETURNING product_id
+""")
+
+
+class WarehouseQuantity(msgspec.Struct):
+    warehouse_id: int
+    quantity: Annotated[int, msgspec.Meta(ge=0)]  # inventory_qty_nonneg CHECK is the DB backstop
+
+
+class CreateProductRequest(msgspec.Struct):
+    name: str
+    sku: str
+    price: Decimal
+    # Expects e.g. 'warehouse_quantities': [{"warehouse_id": 1, "quantity": 50}, ...]
+    warehouse_quantities: Annotated[list[WarehouseQuantity], msgspec.Meta(min_length=1)]
+
 
 @app.route('/api/products', methods=['POST'])
 def create_product():
-    data = request.json or {}
-    required_fields = ['name', 'sku', 'price', 'warehouse_quantities']
-    
-    # 1. Validate input
-    for field in required_fields:
-        if field not in data:
-            return jsonify({"error": f"Missing required field: {field}"}), 400
-
-    # Validate price is decimal-like
+    # 1. Validate input: required fields, types, price as Decimal, non-empty
+    # warehouse list with non-negative quantities, all in one typed decode
     try:
-        price = Decimal(str(data['price']))
-    except (InvalidOperation, TypeError, ValueError):
-        return jsonify({"error": "Invalid price format."}), 400
-
-    # 2. Ensure SKU uniqueness
-    existing = Product.query.filter_by(sku=data['sku']).first()
-    if existing:
-        return jsonify({"error": "SKU must be unique."}), 409
-
-    # 3. Validate warehouse quantities format and data
-    # Expects e.g. 'warehouse_quantities': [{"warehouse_id": 1, "quantity": 50}, ...]
-    warehouse_quantities = data['warehouse_quantities']
-    if not isinstance(warehouse_quantities, list) or not warehouse_quantities:
-        return jsonify({"error": "warehouse_quantities must be a non-empty list."}), 400
-    for w in warehouse_quantities:
-        if not isinstance(w, dict) or \
-           'warehouse_id' not in w or 'quantity' not in w or \
-           not isinstance(w['quantity'], int) or w['quantity'] < 0:
-            return jsonify({"error": "Each warehouse entry must have warehouse_id and non-negative integer quantity."}), 400
-      
-    # 4. Atomic DB operation using a single transaction
+        data = msgspec.json.decode(request.get_data(), type=CreateProductRequest)
+    except msgspec.DecodeError as e:
+        return jsonify({"error": str(e)}), 400
+    warehouse_quantities = data.warehouse_quantities
+
+    # All warehouses must exist and belong to one company: one lookup instead of a failed insert + rollback
+    warehouse_ids = {w.warehouse_id for w in warehouse_quantities}
+    warehouse_companies = dict(db.session.execute(
+        select(Warehouse.id, Warehouse.company_id).where(Warehouse.id.in_(warehouse_ids))
+    ).all())
+    missing_ids = warehouse_ids - warehouse_companies.keys()
+    if missing_ids:
+        return jsonify({
+            "error": "Unknown warehouse_id(s).",
+            "warehouse_ids": sorted(missing_ids)
+        }), 400
+    if len(set(warehouse_companies.values())) > 1:
+        return jsonify({"error": "All warehouses must belong to the same company."}), 400
+
+    # 2. Atomic DB operation: product + all inventory rows in one statement (one round-trip).
+    # SKU uniqueness is enforced by the insert itself (no separate SELECT, no race):
+    # on a duplicate SKU the CTE returns nothing, so no inventory rows and no product_id.
     try:
-        product = Product(
-            name=data['name'],
-            sku=data['sku'],
-            price=price,
-            # Include other optional fields here as needed
-        )
-        db.session.add(product)
-        db.session.flush() # Get product id before committing
-
-        # Insert into each warehouse inventory
-        inventory_entries = []
-        for wq in warehouse_quantities:
-            inventory_entries.append(
-                Inventory(
-                    product_id=product.id,
-                    warehouse_id=wq['warehouse_id'],
-                    quantity=wq['quantity']
-                )
-            )
-        
-        db.session.add_all(inventory_entries)
+        product_id = db.session.execute(
+            CREATE_PRODUCT_WITH_INVENTORY,
+            {
+                "name": data.name,
+                "sku": data.sku,
+                "price": data.price,
+                "warehouse_ids": [wq.warehouse_id for wq in warehouse_quantities],
+                "quantities": [wq.quantity for wq in warehouse_quantities],
+            }
+        ).scalar()
+        if product_id is None:
+            db.session.rollback()
+            return jsonify({"error": "SKU must be unique."}), 409
         db.session.commit()
     except IntegrityError as e:
         db.session.rollback()
-        return jsonify({"error": "Database error, possibly invalid warehouse_id or duplicate entry."}), 400
+        return jsonify({"error": "Database error, possibly duplicate warehouse entry."}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
     
-    return jsonify({"message": "Product created", "product_id": product.id}), 201
+    return jsonify({"message": "Product created", "product_id": product_id}), 201
 
 '''
 Key Changes Explained:
-Input Validation: Check required fields, price format, and warehouse quantities.
+Input Validation: msgspec decodes the body into typed structs (required fields, price format, warehouse quantities).
+Negative quantities are rejected during decode; the inventory_qty_nonneg CHECK constraint backs this up in the DB.
+
+Warehouse Validation: One SELECT checks every warehouse_id exists and that they all belong to the same company.
+This is a consistency check, not tenant isolation; that needs the authenticated caller's company once auth exists.
 
-SKU Uniqueness: Check for existing SKU before inserting.
+SKU Uniqueness: INSERT ... ON CONFLICT (sku) DO NOTHING RETURNING id; no id back means a duplicate SKU (409).
+Checked atomically by the insert, so concurrent creators can't both pass a pre-check.
 
 Transaction safety: Only one commit; rollback on all errors.
 
 Multi-warehouse Support: Allow creating inventory in multiple warehouses at once.
 
+Single Round-Trip Insert: One CTE statement inserts the product and unnests the warehouse/quantity arrays
+into inventory rows, returning the new product id (no flush, no per-row ORM objects).
+
+Sync Endpoint: Converting this view to async SQLAlchemy + asyncpg was considered and declined. Flask async views
+still hold a worker thread (async_to_sync), and asyncpg connections can't cross the per-request event loops,
+forcing NullPool (a new connection per request), a net loss against the pooled sync session.
+
 Decimal for Price: Use Decimal for money values.
 
 Error Feedback: Returns helpful HTTP status codes and messages.
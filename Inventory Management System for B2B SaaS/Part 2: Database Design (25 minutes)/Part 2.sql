@@ -40,13 +40,16 @@ Products
 
 sql
 CREATE TABLE products (
-    id           SERIAL PRIMARY KEY,
+    id           SERIAL,
     sku          VARCHAR(64) NOT NULL UNIQUE,
     name         VARCHAR(255) NOT NULL,
     price        DECIMAL(12,2) NOT NULL,
     supplier_id  INTEGER REFERENCES suppliers(id),
-    is_bundle    BOOLEAN DEFAULT FALSE
+    low_stock_thresh INTEGER NOT NULL DEFAULT 0,
+    is_bundle    BOOLEAN DEFAULT FALSE,
     -- Other optional product fields
+    -- PK covers the low-stock alert columns (index-only scan, no extra index)
+    PRIMARY KEY (id) INCLUDE (low_stock_thresh, supplier_id, sku, name)
 );
 
 ProductBundles
@@ -69,22 +72,92 @@ CREATE TABLE inventory (
     warehouse_id INTEGER NOT NULL REFERENCES warehouses(id) ON DELETE CASCADE,
     product_id   INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
     quantity     INTEGER NOT NULL DEFAULT 0,
-    UNIQUE(warehouse_id, product_id)
+    CONSTRAINT inventory_qty_nonneg CHECK (quantity >= 0),
+    -- Unique index also covers quantity/id for low-stock alerts (index-only scan, no extra index).
+    -- Trade-off: quantity updates are no longer HOT since an indexed column changes.
+    UNIQUE(warehouse_id, product_id) INCLUDE (quantity, id)
     -- Index for quick lookup by warehouse or product
 );
 
 InventoryChanges
 
 sql
+-- Migrating an existing unpartitioned table: move it aside, create the partitioned table
+-- in its place, then copy the history into the monthly partitions (below)
+ALTER TABLE inventory_changes RENAME TO inventory_changes_old;
+
 CREATE TABLE inventory_changes (
-    id              SERIAL PRIMARY KEY,
+    id              SERIAL,
     inventory_id    INTEGER NOT NULL REFERENCES inventory(id) ON DELETE CASCADE,
-    change_type     VARCHAR(32) NOT NULL, -- e.g. 'received', 'sold', 'adjustment', etc.
+    change_type     VARCHAR(32) NOT NULL, -- e.g. 'received', 'sale', 'adjustment', etc.
     quantity_delta  INTEGER NOT NULL,
     occurred_at     TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
-    reference       VARCHAR(255) -- (optional: for order id, PO number, etc.)
+    reference       VARCHAR(255), -- (optional: for order id, PO number, etc.)
     -- Index on (inventory_id, occurred_at) for efficient history queries
+    PRIMARY KEY (id, occurred_at) -- partition key must be part of the PK
+) PARTITION BY RANGE (occurred_at);
+
+-- Monthly partitions so 30-day queries are pruned to the last one or two months.
+-- pg_partman creates all of them, starting at the first month of existing history,
+-- and keeps premaking future ones; the default partition catches any out-of-range row.
+SELECT partman.create_parent(
+    p_parent_table    => 'public.inventory_changes',
+    p_control         => 'occurred_at',
+    p_interval        => '1 month',
+    p_start_partition => (SELECT to_char(date_trunc('month', min(occurred_at)), 'YYYY-MM-DD')
+                          FROM inventory_changes_old),
+    p_default_table   => true
+);
+
+-- Move the history from the old table into the monthly partitions (ids kept), then continue the sequence
+CALL partman.partition_data_proc(
+    p_parent_table => 'public.inventory_changes',
+    p_source_table => 'public.inventory_changes_old'
 );
+SELECT setval(pg_get_serial_sequence('inventory_changes', 'id'),
+              (SELECT max(id) FROM inventory_changes));
+
+-- partition_data_proc moves rows out of the source table; drop it once it is empty
+DROP TABLE inventory_changes_old;
+
+-- Partial index for the mv_recent_sales_30d refresh (its only reader): index-only range scan
+-- on occurred_at over sales, with inventory_id/quantity_delta carried for the GROUP BY/SUM
+-- (created on the parent, so every partition gets its own; CONCURRENTLY isn't allowed here)
+CREATE INDEX ix_ic_sale_recent
+    ON inventory_changes (occurred_at) INCLUDE (inventory_id, quantity_delta)
+    WHERE change_type = 'sale';
+
+-- Pre-aggregated recent sales for low-stock alerts (avoids re-aggregating per request)
+CREATE MATERIALIZED VIEW mv_recent_sales_30d AS
+SELECT inventory_id,
+       SUM(-quantity_delta)        AS total_sales,
+       SUM(-quantity_delta) / 30.0 AS avg_daily_sales
+FROM inventory_changes
+WHERE change_type = 'sale'
+  AND occurred_at >= now() - interval '30 days'
+GROUP BY inventory_id;
+
+-- Unique index is required for REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX ux_mv_recent_sales_30d ON mv_recent_sales_30d (inventory_id);
+
+-- Last refresh time per materialized view (part of the low-stock alerts ETag)
+CREATE TABLE mv_refresh_state (
+    view_name    VARCHAR(64) PRIMARY KEY,
+    refreshed_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
+
+CREATE FUNCTION refresh_mv_recent_sales_30d() RETURNS void LANGUAGE plpgsql AS $$
+BEGIN
+    REFRESH MATERIALIZED VIEW CONCURRENTLY mv_recent_sales_30d;
+    INSERT INTO mv_refresh_state (view_name, refreshed_at)
+    VALUES ('mv_recent_sales_30d', clock_timestamp())
+    ON CONFLICT (view_name) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at;
+END;
+$$;
+
+-- Refresh every minute without blocking readers (pg_cron)
+SELECT cron.schedule('refresh_mv_recent_sales_30d', '* * * * *',
+                     'SELECT refresh_mv_recent_sales_30d()');
 
 /**2. Identify Gaps & Questions for Product Team
 Customer vs Internal Use:
@@ -154,6 +227,9 @@ Inventory quantity is stored per product per warehouse; changes are logged in in
 Indexes:
 Indexes support lookup by warehouse/product and time (for historical queries).
 
+Partitioned History:
+inventory_changes is range-partitioned by month on occurred_at; recent-sales queries only touch the latest partitions.
+
 Decimal for Price:
 Precision is crucial, avoids currency roundoff errors.
 
@@ -5,49 +5,146 @@ Using Python with Flask and SQLAlchemy.
 Must include supplier info for each alert.
 Estimate days_until_stockout as:
 (current_stock) / (avg daily sales in last 30 days), rounded up.
+Response format: {"alerts": [...], "next_cursor": "..." | null}, one keyset page at a time.
+The former "total_alerts" field was removed (it required loading every alert); clients page until next_cursor is null.
 '''
 
-from flask import Flask, jsonify, request
-from sqlalchemy import func, and_, or_
-from datetime import datetime, timedelta
-import math
+from flask import Flask, Response, jsonify, request, stream_with_context
+from flask_caching import Cache
+import orjson
+import base64
+import hashlib
+from sqlalchemy import select, lambda_stmt, func, and_, or_, cast, tuple_, Integer, table, column
 
 app = Flask(__name__)
+# Dashboards poll this endpoint; cache per company for a short TTL (Redis-backed)
+cache = Cache(app, config={"CACHE_TYPE": "RedisCache", "CACHE_DEFAULT_TIMEOUT": 60})
+LOW_STOCK_CACHE_KEY = "low_stock:{company_id}"
+# Bumped by invalidate_low_stock_alerts() on every write that can change a company's alerts
+LOW_STOCK_VERSION_KEY = "low_stock_version:{company_id}"
+# Last refresh of mv_recent_sales_30d, shared by all companies; re-read from the DB at most every 5s
+MV_REFRESHED_AT_CACHE_KEY = "mv_recent_sales_30d:refreshed_at"
+ALERTS_PAGE_SIZE = 500
+ALERTS_MAX_PAGE_SIZE = 1000
 
 # Assume: SQLAlchemy models are defined as per schema above
 # Models: Company, Warehouse, Product, Inventory, InventoryChange, Supplier
 
+# Last-30-days sales per inventory row, refreshed every minute (materialized view, see Part 2)
+recent_sales = table(
+    'mv_recent_sales_30d',
+    column('inventory_id'),
+    column('total_sales'),
+    column('avg_daily_sales'),
+)
+# Written by the pg_cron refresh job after each refresh of the view
+mv_refresh_state = table(
+    'mv_refresh_state',
+    column('view_name'),
+    column('refreshed_at'),
+)
+
+def wants_ndjson():
+    return request.accept_mimetypes.best_match(
+        ["application/json", "application/x-ndjson"]
+    ) == "application/x-ndjson"
+
+def mv_refreshed_at():
+    refreshed_at = cache.get(MV_REFRESHED_AT_CACHE_KEY)
+    if refreshed_at is None:
+        refreshed_at = db.session.scalar(
+            select(mv_refresh_state.c.refreshed_at)
+            .where(mv_refresh_state.c.view_name == 'mv_recent_sales_30d')
+        )
+        cache.set(MV_REFRESHED_AT_CACHE_KEY, refreshed_at, timeout=5)
+    return refreshed_at
+
+def low_stock_etag(company_id, ndjson):
+    # Alerts change when the company writes (version) or the sales view refreshes, which also
+    # covers sales aging out of the 30-day window. JSON and NDJSON get distinct tags.
+    version = cache.get(LOW_STOCK_VERSION_KEY.format(company_id=company_id)) or 0
+    representation = "ndjson" if ndjson else "json"
+    return hashlib.md5(f"{version}:{mv_refreshed_at()}:{representation}".encode()).hexdigest()
+
+def with_validators(response, etag):
+    if etag is not None:
+        response.set_etag(etag)
+    response.vary.add("Accept")  # JSON and NDJSON are served from the same URL
+    return response
+
+def encode_cursor(warehouse_id, product_id):
+    return base64.urlsafe_b64encode(f"{warehouse_id},{product_id}".encode()).decode()
+
+def decode_cursor(cursor):
+    # Raises ValueError on a malformed cursor
+    warehouse_id, product_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(",")
+    return int(warehouse_id), int(product_id)
+
+def json_response(body, etag):
+    return with_validators(app.response_class(body, mimetype="application/json"), etag)
+
+def build_alert(row):
+    return {
+        "product_id": row["product_id"],
+        "product_name": row["product_name"],
+        "sku": row["sku"],
+        "warehouse_id": row["warehouse_id"],
+        "warehouse_name": row["warehouse_name"],
+        "current_stock": row["current_stock"],
+        "threshold": row["threshold"],
+        "days_until_stockout": row["days_until_stockout"],
+        "supplier": None if row["supplier_id"] is None else {
+            "id": row["supplier_id"],
+            "name": row["supplier_name"],
+            "contact_email": row["contact_email"]
+        }
+    }
+
 @app.route('/api/companies/<int:company_id>/alerts/low-stock')
 def low_stock_alerts(company_id):
-    # --- CONFIGURATION ---
-    RECENT_SALES_DAYS = 30
-
-    # 1. Find all company warehouses
-    warehouses = Warehouse.query.filter_by(company_id=company_id).all()
-    warehouse_ids = [w.id for w in warehouses]
-
-    # 2. Find inventory records below threshold and with recent sales
-    # First: build a subquery for average daily sales in last N days
-    since = datetime.utcnow() - timedelta(days=RECENT_SALES_DAYS)
-    sales_subq = (
-        db.session.query(
-            Inventory.inventory_id.label('inventory_id'),
-            func.sum(InventoryChange.quantity_delta * -1).label('total_sales'),  # quantity_delta: -5 for sale of 5
-            (func.sum(InventoryChange.quantity_delta * -1) / RECENT_SALES_DAYS).label('avg_daily_sales')
-        )
-        .filter(
-            InventoryChange.change_type == 'sale',
-            InventoryChange.occurred_at >= since
-        )
-        .join(Inventory, InventoryChange.inventory_id == Inventory.id)
-        .filter(Inventory.warehouse_id.in_(warehouse_ids))
-        .group_by(Inventory.inventory_id)
-        .subquery()
-    )
-
-    # 3. Join inventory, products, thresholds, supplier
-    results = (
-        db.session.query(
+    # 0. Polling clients that already have the current data get a 304 without running the big query.
+    # If Redis is unavailable there is no ETag: skip the 304 and cache paths and just run the query.
+    ndjson = wants_ndjson()
+    try:
+        etag = low_stock_etag(company_id, ndjson)
+    except Exception:
+        app.logger.exception("Cache backend error computing low-stock ETag; serving uncached")
+        etag = None
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        return with_validators(Response(status=304), etag)
+
+    # Keyset pagination on (warehouse_id, product_id): ?cursor=<next_cursor>&limit=N
+    # (JSON only: NDJSON streams the full result, so paging parameters are rejected there)
+    if ndjson and ("cursor" in request.args or "limit" in request.args):
+        return jsonify({"error": "cursor and limit are not supported for application/x-ndjson."}), 400
+    limit = min(max(request.args.get("limit", ALERTS_PAGE_SIZE, type=int), 1), ALERTS_MAX_PAGE_SIZE)
+    cursor = request.args.get("cursor")
+    if cursor is not None:
+        try:
+            after_warehouse_id, after_product_id = decode_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor."}), 400
+
+    # Cached body is only served while its ETag is still current.
+    # Only the default first page is cached (streamed responses are not cached).
+    cache_key = LOW_STOCK_CACHE_KEY.format(company_id=company_id)
+    cacheable = etag is not None and not ndjson and cursor is None and limit == ALERTS_PAGE_SIZE
+    if cacheable:
+        try:
+            cached = cache.get(cache_key)
+        except Exception:
+            app.logger.exception("Cache backend error reading low-stock alerts")
+            cached = None
+        if cached is not None and cached[0] == etag:
+            return json_response(cached[1], etag), 200
+
+    # 1. Find inventory records below threshold and with recent sales:
+    # join inventory, products, thresholds, supplier, scoped to the company via Warehouse.
+    # Average daily sales come pre-aggregated from mv_recent_sales_30d.
+    # Plain column projection, streamed in batches of 500 as mappings (no ORM row objects).
+    # lambda_stmt caches the compiled SQL; company_id is bound from the closure on each call.
+    stmt = lambda_stmt(lambda: (
+        select(
             Product.id.label("product_id"),
             Product.name.label("product_name"),
             Product.sku,
@@ -58,68 +155,104 @@ def low_stock_alerts(company_id):
             Supplier.id.label("supplier_id"),
             Supplier.name.label("supplier_name"),
             Supplier.contact_email,
-            sales_subq.c.avg_daily_sales
+            # Estimate days until stockout in SQL; NULLIF yields NULL (can't estimate) for zero sales
+            cast(
+                func.ceil(Inventory.quantity * 1.0 / func.nullif(recent_sales.c.avg_daily_sales, 0)),
+                Integer
+            ).label("days_until_stockout")
         )
+        .select_from(Product)
         .join(Inventory, Inventory.product_id == Product.id)
         .join(Warehouse, Inventory.warehouse_id == Warehouse.id)
-        .outerjoin(sales_subq, Inventory.id == sales_subq.c.inventory_id)
-        .join(Supplier, Product.supplier_id == Supplier.id)
-        .filter(
-            Inventory.warehouse_id.in_(warehouse_ids),
+        .outerjoin(recent_sales, Inventory.id == recent_sales.c.inventory_id)
+        .outerjoin(Supplier, Product.supplier_id == Supplier.id)  # supplier is optional
+        .where(
+            Warehouse.company_id == company_id,
             Inventory.quantity < Product.low_stock_thresh,
-            sales_subq.c.total_sales != None,              # Only products with recent sales
-            sales_subq.c.total_sales > 0
+            recent_sales.c.total_sales != None,              # Only products with recent sales
+            recent_sales.c.total_sales > 0
         )
-        .all()
-    )
-
-    # 4. Build alerts JSON
-    alerts = []
-    for row in results:
-        avg_daily_sales = row.avg_daily_sales
-        cur_stock = row.current_stock if row.current_stock is not None else 0
-        threshold = row.threshold if row.threshold is not None else 1  # fallback
-        # Estimate days until stockout
-        if avg_daily_sales and avg_daily_sales > 0:
-            days_until_stockout = math.ceil(cur_stock / avg_daily_sales)
-        else:
-            days_until_stockout = None  # can't estimate
-
-        alert = {
-            "product_id": row.product_id,
-            "product_name": row.product_name,
-            "sku": row.sku,
-            "warehouse_id": row.warehouse_id,
-            "warehouse_name": row.warehouse_name,
-            "current_stock": cur_stock,
-            "threshold": threshold,
-            "days_until_stockout": days_until_stockout,
-            "supplier": {
-                "id": row.supplier_id,
-                "name": row.supplier_name,
-                "contact_email": row.contact_email
-            }
-        }
-        alerts.append(alert)
+        .execution_options(yield_per=500)
+    ))
+
+    # Large tenants can ask for NDJSON: rows are streamed as the DB produces them
+    if ndjson:
+        def generate():
+            for row in db.session.execute(stmt).mappings():
+                yield orjson.dumps(build_alert(row)) + b"\n"
+        return with_validators(
+            Response(stream_with_context(generate()), mimetype="application/x-ndjson"), etag
+        )
+
+    # 2. Build one page of alerts JSON; fetch limit + 1 rows to know whether there's a next page
+    if cursor is not None:
+        stmt += lambda s: s.where(
+            tuple_(Inventory.warehouse_id, Inventory.product_id) > tuple_(after_warehouse_id, after_product_id)
+        )
+    stmt += lambda s: s.order_by(Inventory.warehouse_id, Inventory.product_id).limit(limit + 1)
+    alerts = [build_alert(row) for row in db.session.execute(stmt).mappings()]
 
-    return jsonify({
+    next_cursor = None
+    if len(alerts) > limit:
+        alerts = alerts[:limit]
+        next_cursor = encode_cursor(alerts[-1]["warehouse_id"], alerts[-1]["product_id"])
+
+    # orjson serializes straight to bytes; much faster than jsonify for large alert lists
+    body = orjson.dumps({
         "alerts": alerts,
-        "total_alerts": len(alerts)
-    }), 200
+        "next_cursor": next_cursor
+    })
+    if cacheable:
+        try:
+            cache.set(cache_key, (etag, body), timeout=60)
+        except Exception:
+            app.logger.exception("Cache backend error storing low-stock alerts")
+    return json_response(body, etag), 200
 
 # --- ENDPOINT END ---
 
+def invalidate_low_stock_alerts(company_id):
+    # Call after committing any change that can affect the company's alerts: inventory changes,
+    # thresholds, suppliers, warehouse names. Bumping the version moves the ETag for HTTP clients too.
+    # inc is only on the backend (cache.cache), not on the Flask-Caching wrapper.
+    # The write is already committed, so a Redis outage is logged rather than failing the caller.
+    try:
+        cache.cache.inc(LOW_STOCK_VERSION_KEY.format(company_id=company_id))
+        cache.delete(LOW_STOCK_CACHE_KEY.format(company_id=company_id))
+    except Exception:
+        app.logger.exception("Cache backend error invalidating low-stock alerts")
+
 '''Edge Case Handling & Comments
-No Recent Sales: Products/warehouses without sales in period are ignored (sales_subq.c.total_sales != None).
+No Recent Sales: Products/warehouses without sales in period are ignored (recent_sales.c.total_sales != None).
 
-Zero or Null Threshold: Fallback/defaults are used—ideally, your schema enforces presence.
+Sales Freshness: mv_recent_sales_30d is refreshed every minute, so a new sale can take up to a minute to show up.
 
-Division by Zero: Checked—days_until_stockout is None if avg_daily_sales is 0.
+Zero or Null Threshold: The schema enforces presence (quantity NOT NULL, low_stock_thresh NOT NULL DEFAULT 0),
+so no fallbacks are needed; a threshold of 0 never alerts.
+
+Division by Zero: Checked in SQL via NULLIF—days_until_stockout is None if avg_daily_sales is 0.
 
 Suppliers: Assumes one supplier/product; if many, code must aggregate or choose preferred.
+Products without a supplier still alert, with "supplier": null.
 
 Multiple Warehouses: Can alert for same product in multiple warehouses.
 
+Large Alert Lists: JSON responses are paginated by keyset on (warehouse_id, product_id), 500 per page
+by default; pass next_cursor back as ?cursor= for the next page (null on the last page). Clients sending
+Accept: application/x-ndjson get every alert, one per line, streamed.
+
+Caching: Serialized responses are cached per company for 60s alongside their ETag, and only served
+while that ETag is current. Every endpoint that changes alert inputs (inventory, thresholds, suppliers,
+warehouse names) calls invalidate_low_stock_alerts(company_id).
+
+Cache Outages: Redis errors are logged and the endpoint falls back to running the query
+(no ETag, no cached body), so alerts keep working without Redis.
+
+Conditional Requests: The ETag combines a per-company version (Redis, bumped on writes) with the last
+refresh time of mv_recent_sales_30d, so a body built before a refresh is replaced once the view catches up.
+A matching If-None-Match (weak comparison) returns 304 without touching the database, apart from a
+shared refresh-marker lookup at most every 5s. Responses carry Vary: Accept.
+
 Design Justifications
 Indexes:
 